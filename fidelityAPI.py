@@ -1,20 +1,33 @@
+import argparse
 import os
-import traceback
+import logging
 import json
 
 from datetime import datetime
+from decimal import Decimal
 
 from dotenv import load_dotenv
-import pyotp
 import typing
 from typing import Literal
 import re
 
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 from playwright_stealth import StealthConfig, stealth_sync  
 import csv
+import io
 from enum import Enum
 from time import sleep
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import tempfile
+import shutil
 
 
 # Needed for the download_prev_statement function
@@ -35,24 +48,136 @@ class fid_months(Enum):
     Nov = 11
     Dec = 12
 
+# Tracking hosts that the automation never needs. Blocking them speeds up page loads
+BLOCKED_HOSTS = (
+    "doubleclick.net",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "segment.io",
+    "adobedtm.com",
+    "demdex.net",
+    "omtrdc.net",
+    "facebook.net",
+    "facebook.com",
+    "optimizely.com",
+)
+# Only requests to the hosts above go through the route handler. Everything else never leaves the browser
+BLOCKED_HOSTS_PATTERN = re.compile(
+    r"^[a-z]+://([^/?#]*\.)?(" + "|".join(re.escape(host) for host in BLOCKED_HOSTS) + r")(:\d+)?([/?#]|$)"
+)
+
+logger = logging.getLogger(__name__)
+
+# Firefox ignores chromium style command line switches so the same things are turned off through its prefs
+FIREFOX_PREFS = {
+    "webgl.disabled": True,
+    "media.autoplay.default": 5,
+    "browser.sessionstore.resume_from_crash": False,
+    # Background traffic that competes with the pages we are waiting on
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "app.update.auto": False,
+    "extensions.update.enabled": False,
+}
+# Added to the prefs above when block_resources is set.
+# Images are blocked here instead of in a route so image requests aren't sent through python
+BLOCKING_PREFS = {
+    "permissions.default.image": 2,
+}
+
+# Same stealth settings for every page so the config is only built once
+STEALTH_CONFIG = StealthConfig(
+    navigator_languages=False,
+    navigator_user_agent=False,
+    navigator_vendor=False,
+)
+
+# One playwright instance and browser per thread, shared by every FidelityAutomation object made in that thread.
+# The sync API can only be used from the thread that started it. Each object still gets its own context
+_BROWSER_SINGLETON = threading.local()
+
+# Used to clean up the whitespace in error messages from the trade page
+TAB_NEWLINE_RUN = re.compile(r"[\t\n]+")
+SPACE_RUN = re.compile(r" {2,}")
+
+# Account numbers as they show up in the message center and transfer dropdowns
+ROTH_ACCOUNT_NUMBER = re.compile(r"ROTH IRA\s*\((\d+)\)")
+BROKERAGE_ACCOUNT_NUMBER = re.compile(r"\((Z\d+)\)")
+DROPDOWN_ACCOUNT_NUMBER = re.compile(r"[A-Z]?\d{6,}")
+
+# Anything that can't safely go in a folder name
+UNSAFE_PATH_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+# True once a login has landed on the summary page or on any of the 2FA screens
+LOGIN_SETTLED = """() => location.pathname.includes("/portfolio/summary")
+    || document.querySelector('input[placeholder="XXXXXX"], #dom-push-authenticator-header, #dom-channel-list-header') !== null"""
+
+# Columns that must be in the positions csv from fidelity
+POSITIONS_CSV_FIELDS = frozenset((
+    "Account Number",
+    "Account Name",
+    "Symbol",
+    "Description",
+    "Quantity",
+    "Last Price",
+    "Current Value",
+))
+
+# Strips the '$' and thousands separators off of money values
+MONEY_SYMBOLS = str.maketrans("", "", "$,")
+
+# How long a saved session is trusted before logging in from scratch
+STORAGE_STATE_MAX_AGE = 12 * 60 * 60
+
+# Every kind of loading sign fidelity shows, limited to the ones currently visible
+LOADING_SIGNS = ("div:nth-child(2) > .loading-spinner-mask-after:visible, "
+                 ".pvd-spinner__mask-inner:visible, "
+                 "pvd-loading-spinner:visible")
+
+# Opening an account is slow on fidelity's side so its steps keep the old 30 second wait
+ACCOUNT_OPENING_TIMEOUT = 30000
+
+# Each worker thread running scripted accounts has its own browser so only run this many at once
+MAX_PARALLEL_ACCOUNTS = 5
+
+# Month names indexed by month number - 1 so lookups skip the enum machinery
+FID_MONTH_NAMES = tuple(month.name for month in fid_months)
+
 class FidelityAutomation:
     """
     A class to manage and control a playwright webdriver with Fidelity
     """
 
-    def __init__(self, headless=True, title=None, save_state: bool = True, profile_path=".") -> None:
+    def __init__(self, headless=True, title=None, save_state: bool = True, profile_path=".", block_resources: bool = True, user_data_dir: str = None) -> None:
         # Setup the webdriver
         self.headless: bool = headless
+        # Firefox profile folder kept between runs. When set, the browser's cache and cookies persist on disk.
+        # The profile is its own browser so this skips the shared browser and FIDELITY_WS_ENDPOINT
+        self.user_data_dir: str = user_data_dir
+        self.block_resources: bool = block_resources
         self.title: str = title
         self.save_state: bool = save_state
+        self.last_state_hash: bytes = None
         self.profile_path: str = profile_path
         self.account_dict: dict = {}
         self.new_account_number = None
-        self.stealth_config = StealthConfig(
-            navigator_languages=False,
-            navigator_user_agent=False,
-            navigator_vendor=False,
-        )
+        self.from_account_map: dict = {}
+        # The user of the last login on this object
+        self.username: str = None
+        # Cached authenticator used for TOTP logins
+        self.totp = None
+        self.totp_secret: str = None
+        # Where the positions csv is downloaded from. Found on the first call to getAccountInfo
+        self.positions_url: str = None
+        # Hash of the last positions csv that was read into account_dict
+        self.positions_hash: bytes = None
+        # Positions csv files from a remote browser are copied here and removed when the browser is closed.
+        # Only made the first time it is needed
+        self.download_dir: str = None
+        self.stealth_config = STEALTH_CONFIG
         self.getDriver()
 
     def getDriver(self):
@@ -60,9 +185,6 @@ class FidelityAutomation:
         Initializes the playwright webdriver for use in subsequent functions.
         Creates and applies stealth settings to playwright context wrapper.
         """
-        # Set the context wrapper
-        self.playwright = sync_playwright().start()
-
         # Create or load cookies if save_state is set
         if self.save_state:
             self.profile_path = os.path.abspath(self.profile_path)
@@ -74,49 +196,184 @@ class FidelityAutomation:
                 self.profile_path = os.path.join(self.profile_path, "Fidelity.json")
             if not os.path.exists(self.profile_path):
                 os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
-                with open(self.profile_path, "w") as f:
-                    json.dump({}, f)
-
-        # Launch the browser
-        self.browser = self.playwright.firefox.launch(
-            headless=self.headless,
-            args=["--disable-webgl", "--disable-software-rasterizer"],
-        )
+                with open(self.profile_path, "wb") as f:
+                    f.write(b"{}")
 
-        self.context = self.browser.new_context(
-            storage_state=self.profile_path if self.title is not None else None
-        )
-        self.page = self.context.new_page()
+        # Set the context wrapper
+        self.playwright = self.ensure_playwright()
+
+        if self.user_data_dir is not None:
+            # A used profile folder may still hold a logged in session, so try it before logging in
+            self.state_loaded: bool = os.path.isdir(self.user_data_dir) and len(os.listdir(self.user_data_dir)) > 0
+            # The persistent context is its own browser. It keeps the http cache between runs
+            self.browser = None
+            self.context = self.playwright.firefox.launch_persistent_context(
+                self.user_data_dir,
+                headless=self.headless,
+                firefox_user_prefs=self.firefox_prefs(self.block_resources),
+                accept_downloads=True,
+            )
+        else:
+            # Every object in this thread gets its own context on the same browser
+            self.browser = self.ensure_browser(self.headless, self.block_resources)
+
+            # Only restore a session that was saved recently enough to still be logged in
+            # The default Fidelity.json isn't tied to one user so only a titled profile is restored
+            self.state_loaded: bool = self.save_state and self.title is not None and self.storage_state_is_fresh()
+            self.context = self.browser.new_context(
+                storage_state=self.profile_path if self.state_loaded else None,
+                accept_downloads=True,
+            )
+        # Drop trackers for every page in this context, including popups
+        if self.block_resources:
+            self.context.route(BLOCKED_HOSTS_PATTERN, self.block_route)
+        # A persistent context opens with a blank page already
+        self.page = self.context.pages[0] if self.context.pages else self.context.new_page()
+        # Set the timeouts once here. Calls only pass a timeout when they need something different
+        self.page.set_default_timeout(10000)
+        self.page.set_default_navigation_timeout(15000)
         # Apply stealth settings
         stealth_sync(self.page, self.stealth_config)
 
+        # Locators used on every login and order. They are lazy so they stay valid across navigations
+        self.code_box = self.page.get_by_placeholder("XXXXXX")
+        self.save_device_box = self.page.locator("label").filter(has_text="Don't ask me again on this")
+        self.trade_account_dropdown = self.page.locator("#dest-acct-dropdown").first
+        self.symbol_box = self.page.get_by_label("Symbol")
+        self.expanded_ticket = self.page.get_by_role("button", name="View expanded ticket")
+        self.preview_button = self.page.get_by_role("button", name="Preview order")
+        self.place_order_button = self.page.get_by_role("button", name="Place order clicking this")
+
+    @staticmethod
+    def block_route(route, request):
+        """
+        Route handler that aborts requests for tracking hosts.
+        It is only registered for BLOCKED_HOSTS_PATTERN so every request it sees gets dropped.
+        """
+        return route.abort()
+
+    def storage_state_is_fresh(self) -> bool:
+        """
+        Checks if the saved storage state has cookies in it and was written within STORAGE_STATE_MAX_AGE.
+
+        Returns:
+            True: bool: If the storage state file can be used to skip logging in
+            False: bool: If the file is empty or too old
+        """
+        try:
+            # An empty file only contains '{}'
+            if os.path.getsize(self.profile_path) <= 2:
+                return False
+            return (datetime.now().timestamp() - os.path.getmtime(self.profile_path)) < STORAGE_STATE_MAX_AGE
+        except OSError:
+            return False
+
     def save_storage_state(self):
         """
         Saves the storage state of the browser to a file.
 
         This method saves the storage state of the browser to a file so that it can be restored later.
         This will do nothing if the class object was initialized with save_state=False
+        or if the state hasn't changed since it was last saved
 
         Args:
             filename (str): The name of the file to save the storage state to.
         """
         if self.save_state:
             storage_state = self.page.context.storage_state()
-            with open(self.profile_path, "w") as f:
-                json.dump(storage_state, f)
+            # orjson is much faster on the big cookie blobs but isn't required
+            if orjson is not None:
+                storage_state = orjson.dumps(storage_state)
+            else:
+                storage_state = json.dumps(storage_state, separators=(",", ":")).encode()
+            # Skip the write if nothing changed since the last save
+            state_hash = hashlib.blake2b(storage_state, digest_size=16).digest()
+            if state_hash == self.last_state_hash:
+                return
+            # Write to a temp file first so a crash can't leave a half written state behind
+            temp_path = self.profile_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(storage_state)
+            os.replace(temp_path, self.profile_path)
+            self.last_state_hash = state_hash
 
     def close_browser(self):
         """
-        Closes the playwright browser
-        Use when you are completely done with this class
+        Closes this object's browser context.
+        The shared browser is left running for other objects, call FidelityAutomation.shutdown() to close it
         """
         # Save cookies
         self.save_storage_state()
-        # Close context before browser as directed by documentation
         self.context.close()
-        self.browser.close()
-        # Stop the instance of playwright
-        self.playwright.stop()
+        # Remove the download folder
+        if self.download_dir is not None:
+            shutil.rmtree(self.download_dir, ignore_errors=True)
+            self.download_dir = None
+
+    @classmethod
+    def ensure_playwright(cls):
+        """
+        Starts playwright for this thread if it isn't running already.
+
+        Returns:
+            playwright: Playwright: The playwright instance shared by every object made in this thread
+        """
+        shared = _BROWSER_SINGLETON
+        if getattr(shared, "playwright", None) is None:
+            shared.playwright = sync_playwright().start()
+        return shared.playwright
+
+    @classmethod
+    def ensure_browser(cls, headless: bool = True, block_resources: bool = True):
+        """
+        Launches the browser for this thread if there isn't one running already.
+        The first call to launch decides if the shared browser is headless and if it loads images,
+        since firefox prefs are set for the whole browser
+
+        Parameters:
+            headless: bool: If the browser should be launched headless
+            block_resources: bool: If the browser should skip loading images
+
+        Returns:
+            browser: Browser: The browser shared by every object made in this thread
+        """
+        playwright = cls.ensure_playwright()
+        shared = _BROWSER_SINGLETON
+        if getattr(shared, "browser", None) is None or not shared.browser.is_connected():
+            # Connect to an already running playwright browser server if one is given to skip the launch
+            ws_endpoint = os.getenv("FIDELITY_WS_ENDPOINT")
+            if ws_endpoint:
+                shared.browser = playwright.firefox.connect(ws_endpoint)
+            else:
+                shared.browser = playwright.firefox.launch(
+                    headless=headless,
+                    firefox_user_prefs=cls.firefox_prefs(block_resources),
+                )
+        return shared.browser
+
+    @staticmethod
+    def firefox_prefs(block_resources: bool) -> dict:
+        """
+        Returns the firefox prefs to launch with. Image loading is only turned off when blocking resources
+        """
+        if block_resources:
+            return {**FIREFOX_PREFS, **BLOCKING_PREFS}
+        return FIREFOX_PREFS
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Closes the browser shared by all objects made in this thread and stops playwright.
+        Use when you are completely done with this class
+        """
+        shared = _BROWSER_SINGLETON
+        # Close browser before stopping playwright as directed by documentation
+        if getattr(shared, "browser", None) is not None:
+            shared.browser.close()
+        if getattr(shared, "playwright", None) is not None:
+            shared.playwright.stop()
+        shared.browser = None
+        shared.playwright = None
 
     def login(self, username: str, password: str, totp_secret: str = None, save_device: bool = True, source_account: str = None) -> bool:
         """
@@ -129,24 +386,69 @@ class FidelityAutomation:
             False, False: Initial login attempt failed.
         """
         try:
-            # Go to the login page
-            self.page.goto(
-                url="https://digital.fidelity.com/prgw/digital/login/full-page",
-                timeout=60000,
-            )
+            # Only trust a restored session on the first login of this object.
+            # Later logins may be for someone else so they always go through the form
+            restored = self.state_loaded
+            self.state_loaded = False
+            # The transfer dropdown belongs to whoever was logged in before
+            self.from_account_map = {}
+            # Don't let the previous user's session carry over into this login
+            if self.username is not None and self.username != username:
+                self.context.clear_cookies()
+            self.username = username
+
+            # If a saved session was restored, see if it is still logged in before going through the login
+            redirected_to_login = False
+            if restored:
+                self.page.goto(url="https://digital.fidelity.com/ftgw/digital/portfolio/summary", timeout=60000)
+                # An expired session gets sent to the login page
+                redirected_to_login = "/login" in self.page.url
+                if "summary" in self.page.url:
+                    if source_account:
+                        self.source_account = source_account
+                    # Save the refreshed cookies so the session stays fresh for the next run
+                    self.save_storage_state()
+                    return (True, True)
+
+            # Go to the login page. An expired saved session already redirected there so don't load it twice.
+            # Otherwise always load it fresh since an earlier login may have stopped on a 2FA screen
+            if not redirected_to_login:
+                self.page.goto(url="https://digital.fidelity.com/prgw/digital/login/full-page", wait_until="domcontentloaded", timeout=60000)
 
             # Login page
-            self.page.get_by_label("Username", exact=True).click()
-            self.page.get_by_label("Username", exact=True).fill(username)
-            self.page.get_by_label("Password", exact=True).click()
-            self.page.get_by_label("Password", exact=True).fill(password)
-            self.page.get_by_role("button", name="Log in").click()
-            # Wait for loading spinner to go away
-            self.wait_for_loading_sign()
+            username_box = self.page.get_by_label("Username", exact=True)
+            username_box.fill(username)
+            password_box = self.page.get_by_label("Password", exact=True)
+            password_box.fill(password)
+            # Wait on the response to the credentials being posted instead of polling for the loading spinner.
+            # If it can't be seen quickly, fall back to waiting for the spinner to go away
+            clicked = False
+            try:
+                with self.page.expect_response(
+                    lambda response: "login" in response.url and response.request.method == "POST",
+                    timeout=5000,
+                ):
+                    self.page.get_by_role("button", name="Log in").click()
+                    clicked = True
+            except PlaywrightTimeoutError:
+                # A click that failed is a real error, only a missing response falls back
+                if not clicked:
+                    raise
+                self.wait_for_loading_sign()
 
-            # See if the summary page has been reached
-            self.page.wait_for_load_state(timeout=60000, state="load")
+            # Wait for whichever shows up first, the summary page or one of the 2FA screens.
+            # A login that needs a code no longer sits out a fixed wait for the summary page first
+            try:
+                self.page.wait_for_function(LOGIN_SETTLED, timeout=10000)
+            except PlaywrightTimeoutError:
+                pass
+
+            # See if the summary page has been reached. Only the document is needed to know where we landed
+            self.page.wait_for_load_state(timeout=60000, state="domcontentloaded")
             if "summary" in self.page.url:
+                if source_account:
+                    self.source_account = source_account
+                self.save_storage_state()
                 return (True, True)
 
             # Check to see if TOTP secret is blank or "NA"
@@ -155,22 +457,27 @@ class FidelityAutomation:
             # If we hit the 2fA page after trying to login
             if "login" in self.page.url:
                 self.wait_for_loading_sign()
-                widget = self.page.locator("#dom-widget div").first
-                widget.wait_for(timeout=5000, state='visible')
+                try_another_way = self.page.get_by_role("link", name="Try another way")
+                text_me = self.page.get_by_role("button", name="Text me the code")
+                # Wait once for whichever 2FA screen shows up instead of probing for each one in turn
+                self.code_box.or_(try_another_way).or_(text_me).first.wait_for(timeout=5000, state="visible")
+                code_screen = self.code_box.is_visible()
                 # If TOTP secret is provided, we are will use the TOTP key. See if authenticator code is present
-                if (totp_secret is not None and self.page.get_by_placeholder("XXXXXX").is_visible()):
-                    # Get authenticator code
-                    code = pyotp.TOTP(totp_secret).now()
+                if (totp_secret is not None and code_screen):
+                    # Get authenticator code. Only build the TOTP object again if the secret changed
+                    if self.totp is None or self.totp_secret != totp_secret:
+                        # pyotp is only needed here so don't import it up front
+                        import pyotp
+                        self.totp = pyotp.TOTP(totp_secret)
+                        self.totp_secret = totp_secret
+                    code = self.totp.now()
                     # Enter the code
-                    self.page.get_by_placeholder("XXXXXX").click()
-                    self.page.get_by_placeholder("XXXXXX").fill(code)
+                    self.code_box.fill(code)
 
                     # Prevent future OTP requirements
                     if save_device:
-                        # Check this box
-                        self.page.locator("label").filter(has_text="Don't ask me again on this").check()
-                        if (not self.page.locator("label").filter(has_text="Don't ask me again on this").is_checked()):
-                            raise Exception("Cannot check 'Don't ask me again on this device' box")
+                        # Check this box. check() raises if the box doesn't end up checked
+                        self.save_device_box.check()
 
                     # Log in with code
                     self.page.get_by_role("button", name="Continue").click()
@@ -182,6 +489,7 @@ class FidelityAutomation:
                     self.page.wait_for_url(
                         "https://digital.fidelity.com/ftgw/digital/portfolio/summary",
                         timeout=5000,
+                        wait_until="commit",
                     )
 
                     # After successful login, store the source account if provided
@@ -189,11 +497,14 @@ class FidelityAutomation:
                         self.source_account = source_account
                     print(f"Source account saved: {self.source_account}")
 
+                    # Save the session so the next run can skip logging in
+                    self.save_storage_state()
+
                     # Got to the summary page, return True
                     return (True, True)
 
                 # If the authenticator code is the only way but we don't have the secret, return error
-                if self.page.get_by_text(
+                if code_screen and self.page.get_by_text(
                     "Enter the code from your authenticator app This security code will confirm the"
                 ).is_visible():
                     raise Exception(
@@ -201,17 +512,15 @@ class FidelityAutomation:
                     )
 
                 # If the app push notification page is present
-                if self.page.get_by_role("link", name="Try another way").is_visible():
-                    self.page.locator("label").filter(has_text="Don't ask me again on this").check()
-                    if (not self.page.locator("label").filter(has_text="Don't ask me again on this").is_checked()):
-                        raise Exception("Cannot check 'Don't ask me again on this device' box")
+                if try_another_way.is_visible():
+                    self.save_device_box.check()
 
                     # Click on alternate verification method to get OTP via text
-                    self.page.get_by_role("link", name="Try another way").click()
+                    try_another_way.click()
 
                 # Press the Text me button
-                self.page.get_by_role("button", name="Text me the code").click()
-                self.page.get_by_placeholder("XXXXXX").click()
+                text_me.click()
+                self.code_box.click()
 
                 return (True, False)
 
@@ -223,7 +532,8 @@ class FidelityAutomation:
             return (False, False)
         except Exception as e:
             print(f"An error occurred: {str(e)}")
-            traceback.print_exc()
+            # Full traceback only when debug logging is turned on
+            logger.debug("Login failed", exc_info=True)
             return (False, False)
 
     def login_2FA(self, code):
@@ -235,24 +545,19 @@ class FidelityAutomation:
             False: bool: If login failed, return false.
         """
         try:
-            self.page.get_by_placeholder("XXXXXX").fill(code)
+            self.code_box.fill(code)
 
             # Prevent future OTP requirements
-            self.page.locator("label").filter(
-                has_text="Don't ask me again on this"
-            ).check()
-            if (
-                not self.page.locator("label")
-                .filter(has_text="Don't ask me again on this")
-                .is_checked()
-            ):
-                raise Exception("Cannot check 'Don't ask me again on this device' box")
+            self.save_device_box.check()
             self.page.get_by_role("button", name="Submit").click()
 
             self.page.wait_for_url(
                 "https://digital.fidelity.com/ftgw/digital/portfolio/summary",
                 timeout=5000,
+                wait_until="commit",
             )
+            # Save the session so the next run can skip logging in
+            self.save_storage_state()
             return True
 
         except PlaywrightTimeoutError:
@@ -260,7 +565,7 @@ class FidelityAutomation:
             return False
         except Exception as e:
             print(f"An error occurred: {str(e)}")
-            traceback.print_exc()
+            logger.debug("2FA login failed", exc_info=True)
             return False
 
     def getAccountInfo(self):
@@ -275,104 +580,135 @@ class FidelityAutomation:
             'type': str: The account nickname or default name
             'stocks': list: A list of dictionaries for each stock found. The dict has:
                 'ticker': str: The ticker of the stock held
-                'quantity': str: The quantity of stocks with 'ticker' held
-                'last_price': str: The last price of the stock with the $ sign removed
-                'value': str: The total value of the position
+                'quantity': float: The quantity of stocks with 'ticker' held
+                'last_price': float: The last price of the stock
+                'value': float: The total value of the position
         """
-        # Go to positions page
-        self.page.goto("https://digital.fidelity.com/ftgw/digital/portfolio/positions")
+        data = None
+        # Once we know where the csv comes from, ask for it directly with the session's cookies.
+        # This skips loading the positions page and saving the file to disk
+        if self.positions_url is not None:
+            response = self.context.request.get(self.positions_url)
+            body = response.body() if response.ok else b""
+            # An expired session can still answer 200 with a login page. Only trust it if the first line is the csv header
+            header = body.removeprefix(b"\xef\xbb\xbf").split(b"\n", 1)[0]
+            if b"Account Number" in header:
+                data = body
+            else:
+                # Forget the url and download from the positions page like the first time
+                self.positions_url = None
+
+        # Otherwise download it from the positions page
+        if data is None:
+            # Go to positions page
+            self.goto_if_needed("https://digital.fidelity.com/ftgw/digital/portfolio/positions")
+
+            # Download the positions as a csv
+            with self.page.expect_download() as download_info:
+                self.page.get_by_label("Download Positions").click()
+            download = download_info.value
+            # Remember where it came from for next time. Files built in the page (blob: urls) can't be requested again
+            if download.url.startswith("http"):
+                self.positions_url = download.url
+            try:
+                # Read playwright's own copy of the download instead of copying it somewhere else first
+                positions_csv = download.path()
+            except PlaywrightError:
+                # When connected to a remote browser the file isn't on this machine so it has to be copied over
+                if self.download_dir is None:
+                    self.download_dir = tempfile.mkdtemp(prefix="fidelity_csv_")
+                positions_csv = os.path.join(self.download_dir, download.suggested_filename)
+                download.save_as(positions_csv)
+            # Playwright deletes its downloads when the context closes
+            # and anything in self.download_dir is removed in close_browser
+            with open(positions_csv, "rb") as f:
+                data = f.read()
+
+        # Skip parsing if the positions haven't changed since the last time.
+        # The download time at the bottom of the file changes every time so leave it out of the hash
+        positions_hash = hashlib.blake2b(data.partition(b"Date downloaded")[0], digest_size=16).digest()
+        if positions_hash == self.positions_hash:
+            return self.account_dict
+
+        self.read_positions_csv(io.StringIO(data.decode("utf-8-sig"), newline=""))
+        self.positions_hash = positions_hash
 
-        # Download the positions as a csv
-        with self.page.expect_download() as download_info:
-            self.page.get_by_label("Download Positions").click()
-        download = download_info.value
-        cur = os.getcwd()
-        positions_csv = os.path.join(cur, download.suggested_filename)
-        # Create a copy to work on with the proper file name known
-        download.save_as(positions_csv)
+        return self.account_dict
+
+    def read_positions_csv(self, csv_file):
+        """
+        Fills self.account_dict from an open positions csv from fidelity.
+        Any accounts already in self.account_dict are replaced.
 
-        csv_file = open(positions_csv, newline="", encoding="utf-8-sig")
+        Parameters:
+            csv_file: A file-like object of the positions csv opened with newline=""
+        """
+        self.account_dict = {}
 
-        reader = csv.DictReader(csv_file)
+        # Plain reader so a dict isn't built for every row. Columns are looked up by index instead
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
         # Ensure all fields we want are present
-        required_elements = [
-            "Account Number",
-            "Account Name",
-            "Symbol",
-            "Description",
-            "Quantity",
-            "Last Price",
-            "Current Value",
-        ]
-        intersection_set = set(reader.fieldnames).intersection(set(required_elements))
-        if len(intersection_set) != len(required_elements):
+        if not POSITIONS_CSV_FIELDS.issubset(header):
             raise Exception("Not enough elements in fidelity positions csv")
 
+        # Column index of each field we use
+        account_number_idx = header.index("Account Number")
+        account_name_idx = header.index("Account Name")
+        symbol_idx = header.index("Symbol")
+        quantity_idx = header.index("Quantity")
+        last_price_idx = header.index("Last Price")
+        value_idx = header.index("Current Value")
+        width = len(header)
+
         for row in reader:
+            # Skip blank lines
+            if not row:
+                continue
+            # Fill in any missing fields at the end of short rows
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            account_number = row[account_number_idx]
             # Last couple of rows have some disclaimers, filter those out
-            if row["Account Number"] is not None and "and" in str(
-                row["Account Number"]
-            ):
+            if "and" in account_number:
                 break
+            # Get ticker
+            ticker = row[symbol_idx]
+            # Don't include this if present. Checked before anything else in the row is cleaned up
+            if "Pending" in ticker:
+                continue
             # Get the value and remove '$' from it
-            val = str(row["Current Value"]).replace("$", "")
+            val = row[value_idx].translate(MONEY_SYMBOLS)
             # Get the last price
-            last_price = str(row["Last Price"]).replace("$", "")
+            last_price = row[last_price_idx].translate(MONEY_SYMBOLS)
             # Get quantity
-            quantity = row["Quantity"]
-            # Get ticker
-            ticker = str(row["Symbol"])
+            quantity = row[quantity_idx]
 
-            # Don't include this if present
-            if "Pending" in ticker:
-                continue
             # If the value isn't present, move to next row
             if len(val) == 0:
                 continue
-            if val.lower() == "n/a":
-                val = 0
+            # Convert to numbers once here so nothing downstream has to parse them again
+            val = 0.0 if val.lower() == "n/a" else float(val)
             # If the last price isn't available, just use the current value
-            if len(last_price) == 0:
-                last_price = val
+            last_price = float(last_price) if len(last_price) != 0 else val
             # If the quantity is missing, just use 1
-            if len(quantity) == 0:
-                quantity = 1
-
-            # If the account number isn't populated yet, add it
-            if row["Account Number"] not in self.account_dict:
-                # Add retrieved info.
-                # Yeah I know is kinda messy and hard to think about but it works
-                # Just need a way to store all stocks with the account number
-                # 'stocks' is a list of dictionaries. Each ticker gets its own index and is described by a dictionary
-                self.account_dict[row["Account Number"]] = {
-                    "balance": float(val),
-                    "type": row["Account Name"],
-                    "stocks": [
-                        {
-                            "ticker": ticker,
-                            "quantity": quantity,
-                            "last_price": last_price,
-                            "value": val,
-                        }
-                    ],
-                }
-            # If it is present, add to it
-            else:
-                self.account_dict[row["Account Number"]]["stocks"].append(
-                    {
-                        "ticker": ticker,
-                        "quantity": quantity,
-                        "last_price": last_price,
-                        "value": val,
-                    }
-                )
-                self.account_dict[row["Account Number"]]["balance"] += float(val)
+            quantity = float(quantity) if len(quantity) != 0 else 1.0
 
-        # Close the file
-        csv_file.close()
-        os.remove(positions_csv)
-
-        return self.account_dict
+            # Get the account entry, adding it if the account number isn't populated yet
+            # 'stocks' is a list of dictionaries. Each ticker gets its own index and is described by a dictionary
+            account_entry = self.account_dict.setdefault(
+                account_number,
+                {"balance": 0.0, "type": row[account_name_idx], "stocks": []},
+            )
+            account_entry["stocks"].append(
+                {
+                    "ticker": ticker,
+                    "quantity": quantity,
+                    "last_price": last_price,
+                    "value": val,
+                }
+            )
+            account_entry["balance"] += val
 
     def summary_holdings(self) -> dict:
         """
@@ -390,19 +726,12 @@ class FidelityAutomation:
         for account_number in self.account_dict:
             for stock_dict in self.account_dict[account_number]["stocks"]:
                 # Create a list of unique holdings
-                if stock_dict["ticker"] not in unique_stocks:
-                    unique_stocks[stock_dict["ticker"]] = {
-                        "quantity": float(stock_dict["quantity"]),
-                        "last_price": float(stock_dict["last_price"]),
-                        "value": float(stock_dict["value"]),
-                    }
-                else:
-                    unique_stocks[stock_dict["ticker"]]["quantity"] += float(
-                        stock_dict["quantity"]
-                    )
-                    unique_stocks[stock_dict["ticker"]]["value"] += float(
-                        stock_dict["value"]
-                    )
+                holding = unique_stocks.setdefault(
+                    stock_dict["ticker"],
+                    {"quantity": 0.0, "last_price": stock_dict["last_price"], "value": 0.0},
+                )
+                holding["quantity"] += stock_dict["quantity"]
+                holding["value"] += stock_dict["value"]
 
         # Create a summary of holdings
         summary = ""
@@ -433,38 +762,53 @@ class FidelityAutomation:
             returned and Error_message will be None. Otherwise, False will be returned and Error_message will not be None
         """
         try:
+            # Title capitalizes the first letter so 'buy' -> 'Buy'
+            action_title = action.lower().title()
+            account_upper = account.upper()
+            account_option = self.page.get_by_role("option").filter(has_text=account_upper)
+
             # Go to the trade page
-            if (self.page.url != "https://digital.fidelity.com/ftgw/digital/trade-equity/index/orderEntry"):
-                self.page.goto("https://digital.fidelity.com/ftgw/digital/trade-equity/index/orderEntry")
+            self.goto_if_needed("https://digital.fidelity.com/ftgw/digital/trade-equity/index/orderEntry")
 
             # Click on the drop down
-            self.page.query_selector("#dest-acct-dropdown").click()
+            self.trade_account_dropdown.click()
 
-            if (not self.page.get_by_role("option").filter(has_text=account.upper()).is_visible()):
+            # Give the options a moment to render before deciding the drop down is empty
+            if not self.is_visible_within(account_option, timeout=2000):
                 # Reload the page and hit the drop down again
                 # This is to prevent a rare case where the drop down is empty
                 print("Reloading...")
                 self.page.reload()
                 # Click on the drop down
-                self.page.query_selector("#dest-acct-dropdown").click()
+                self.trade_account_dropdown.click()
             # Find the account to trade under
-            self.page.get_by_role("option").filter(has_text=account.upper()).click()
+            account_option.click()
 
             # Enter the symbol
-            self.page.get_by_label("Symbol").click()
-            # Fill in the ticker
-            self.page.get_by_label("Symbol").fill(stock)
+            # Fill in the ticker. fill focuses the box itself
+            self.symbol_box.fill(stock)
             # Find the symbol we wanted and click it
-            self.page.get_by_label("Symbol").press("Enter")
-
-            # Wait for quote panel to show up
-            self.page.locator("#quote-panel").wait_for(timeout=2000)
-            last_price = self.page.query_selector("#eq-ticket__last-price > span.last-price").text_content()
-            last_price = last_price.replace("$", "")
+            self.symbol_box.press("Enter")
+
+            # Wait for quote panel to show up and read the last price from it in the same call
+            last_price = self.page.wait_for_function(
+                """() => {
+                    const price = document.querySelector("#quote-panel")
+                        && document.querySelector("#eq-ticket__last-price > span.last-price");
+                    return price && price.textContent.trim() ? price.textContent : null;
+                }""",
+                timeout=2000,
+            ).json_value()
+            # Decimal so the limit price math doesn't pick up float noise like 0.30000000000000004
+            last_price = Decimal(last_price.translate(MONEY_SYMBOLS))
 
             # Ensure we are in the expanded ticket
-            if self.page.get_by_role("button", name="View expanded ticket").is_visible():
-                self.page.get_by_role("button", name="View expanded ticket").click()
+            # Just try the click. If the ticket is already expanded the button isn't there and it fails fast
+            try:
+                self.expanded_ticket.click(timeout=500)
+            except PlaywrightTimeoutError:
+                pass
+            else:
                 # Wait for it to take effect
                 self.page.get_by_role("button", name="Calculate shares").wait_for(timeout=2000)
 
@@ -472,38 +816,39 @@ class FidelityAutomation:
             extended = False
             precision = 3
             # Enable extended hours trading if available
-            if self.page.get_by_text("Extended hours trading").is_visible():
-                if self.page.get_by_text("Extended hours trading: OffUntil 8:00 PM ET").is_visible():
-                    self.page.get_by_text("Extended hours trading: OffUntil 8:00 PM ET").check()
+            if self.is_visible_within(self.page.get_by_text("Extended hours trading")):
+                extended_off = self.page.get_by_text("Extended hours trading: OffUntil 8:00 PM ET")
+                if extended_off.is_visible():
+                    extended_off.check()
                 extended = True
                 precision = 2
 
-            # Press the buy or sell button. Title capitalizes the first letter so 'buy' -> 'Buy'
-            self.page.query_selector(".eq-ticket-action-label").click()
-            self.page.get_by_role("option", name=action.lower().title(), exact=True).wait_for()
-            self.page.get_by_role("option", name=action.lower().title(), exact=True).click()
+            # Press the buy or sell button
+            self.page.locator(".eq-ticket-action-label").first.click()
+            action_option = self.page.get_by_role("option", name=action_title, exact=True)
+            action_option.wait_for()
+            action_option.click()
 
             # Press the shares text box
             self.page.locator("#eqt-mts-stock-quatity div").filter(has_text="Quantity").click()
             self.page.get_by_text("Quantity", exact=True).fill(str(quantity))
 
             # If it should be limit
-            if float(last_price) < 1 or extended:
+            if last_price < 1 or extended:
+                difference_price = Decimal("0.01") if last_price > Decimal("0.1") else Decimal("0.0001")
                 # Buy above
-                if action.lower() == "buy":
-                    difference_price = 0.01 if float(last_price) > 0.1 else 0.0001
-                    wanted_price = round(float(last_price) + difference_price, precision)
+                if action_title == "Buy":
+                    wanted_price = round(last_price + difference_price, precision)
                 # Sell below
                 else:
-                    difference_price = 0.01 if float(last_price) > 0.1 else 0.0001
-                    wanted_price = round(float(last_price) - difference_price, precision)
+                    wanted_price = round(last_price - difference_price, precision)
 
                 # Click on the limit default option when in extended hours
-                self.page.query_selector("#dest-dropdownlist-button-ordertype > span:nth-child(1)").click()
+                self.page.locator("#dest-dropdownlist-button-ordertype > span:nth-child(1)").first.click()
                 self.page.get_by_role("option", name="Limit", exact=True).click()
                 # Enter the limit price
-                self.page.get_by_text("Limit price", exact=True).click()
-                self.page.get_by_label("Limit price").fill(str(wanted_price))
+                # Drop the trailing zeros Decimal keeps from rounding. Ex: 0.460 is typed as 0.46
+                self.page.get_by_label("Limit price").fill(format(wanted_price.normalize(), "f"))
             # Otherwise its market
             else:
                 # Click on the market
@@ -511,56 +856,63 @@ class FidelityAutomation:
                 self.page.get_by_role("option", name="Market", exact=True).click()
 
             # Continue with the order
-            self.page.get_by_role("button", name="Preview order").click()
+            self.preview_button.click()
 
             # If error occurred
             try:
-                self.page.get_by_role("button", name="Place order clicking this").wait_for(timeout=4000, state="visible")
+                self.place_order_button.wait_for(timeout=4000, state="visible")
             except PlaywrightTimeoutError:
                 # Error must be present (or really slow page for some reason)
                 # Try to report on error
                 error_message = ""
-                filtered_error = ""
+                # The error is either in a popup or inline. Wait for both at once instead of one after the other
+                error_popup = self.page.get_by_label("Error").locator("div").filter(has_text="critical").nth(2)
+                error_inline = self.page.locator('.pvd-inline-alert__content font[color="red"]').first
                 try:
-                    error_message = (self.page.get_by_label("Error").locator("div").filter(has_text="critical").nth(2).text_content(timeout=2000))
+                    error_popup.or_(error_inline).first.wait_for(timeout=2000, state="attached")
+                    if error_popup.count() > 0:
+                        error_message = error_popup.text_content()
+                    else:
+                        error_message = error_inline.text_content()
                     self.page.get_by_role("button", name="Close dialog").click()
                 except Exception:
                     pass
-                if error_message == "":
-                    try:
-                        error_message = self.page.wait_for_selector('.pvd-inline-alert__content font[color="red"]', timeout=2000).text_content()
-                        self.page.get_by_role("button", name="Close dialog").click()
-                    except Exception:
-                        pass
                 # Return with error and trim it down (it contains many spaces for some reason)
                 if error_message != "":
-                    for i, character in enumerate(error_message):
-                        if (
-                            (character == " " and error_message[i - 1] == " ")
-                            or character == "\n"
-                            or character == "\t"
-                        ):
-                            continue
-                        filtered_error += character
-
-                    filtered_error = filtered_error.replace("critical", "").strip()
-                    error_message = filtered_error.replace("\n", "")
+                    filtered_error = SPACE_RUN.sub(" ", TAB_NEWLINE_RUN.sub("", error_message))
+                    error_message = filtered_error.replace("critical", "").strip()
                 else:
                     error_message = "Could not retrieve error message from popup"
                 return (False, error_message)
 
-            # If no error occurred, continue with checking the order preview
-            if (
-                not self.page.locator("preview").filter(has_text=account.upper()).is_visible()
-                or not self.page.get_by_text(f"Symbol{stock.upper()}", exact=True).is_visible()
-                or not self.page.get_by_text(f"Action{action.lower().title()}").is_visible()
-                or not self.page.get_by_text(f"Quantity{quantity}").is_visible()
-            ):
+            # If no error occurred, continue with checking the order preview.
+            # All the checks are done in one evaluate instead of a round trip each.
+            # Only visible text inside the visible preview counts so leftover or hidden DOM can't pass the check
+            preview_ok = self.page.evaluate(
+                """([account, symbol, action, quantity]) => {
+                    const visible = (el) => el.getClientRects().length > 0
+                        && getComputedStyle(el).visibility !== 'hidden';
+                    const squash = (text) => text.replace(/\\s+/g, '');
+                    const preview = Array.from(document.querySelectorAll('preview'))
+                        .find(el => visible(el) && el.innerText.includes(account));
+                    if (!preview) {
+                        return false;
+                    }
+                    const previewText = squash(preview.innerText).toLowerCase();
+                    // The symbol has to match a whole element exactly, case included
+                    return Array.from(preview.querySelectorAll('*'))
+                            .some(el => visible(el) && squash(el.innerText) === symbol)
+                        && previewText.includes(squash(action).toLowerCase())
+                        && previewText.includes(squash(quantity).toLowerCase());
+                }""",
+                [account_upper, f"Symbol{stock.upper()}", f"Action{action_title}", f"Quantity{quantity}"],
+            )
+            if not preview_ok:
                 return (False, "Order preview is not what is expected")
 
             # If its a real run
             if not dry:
-                self.page.get_by_role("button", name="Place order clicking this").click()
+                self.place_order_button.click()
                 try:
                     # See that the order goes through
                     self.page.get_by_text("Order received").wait_for(timeout=5000, state="visible")
@@ -576,117 +928,6 @@ class FidelityAutomation:
         except Exception as e:
             return (False, e)
 
-    def getAccountInfo(self):
-        """
-        Gets account numbers, account names, and account totals by downloading the csv of positions from fidelity.
-
-        Post Conditions:
-            self.account_dict is populated with holdings for each account
-        Returns:
-            account_dict: dict: A dictionary using account numbers as keys. Each key holds a dict which has:
-            'balance': float: Total account balance
-            'type': str: The account nickname or default name
-            'stocks': list: A list of dictionaries for each stock found. The dict has:
-                'ticker': str: The ticker of the stock held
-                'quantity': str: The quantity of stocks with 'ticker' held
-                'last_price': str: The last price of the stock with the $ sign removed
-                'value': str: The total value of the position
-        """
-        # Go to positions page
-        self.page.goto("https://digital.fidelity.com/ftgw/digital/portfolio/positions")
-
-        # Download the positions as a csv
-        with self.page.expect_download() as download_info:
-            self.page.get_by_label("Download Positions").click()
-        download = download_info.value
-        cur = os.getcwd()
-        positions_csv = os.path.join(cur, download.suggested_filename)
-        # Create a copy to work on with the proper file name known
-        download.save_as(positions_csv)
-
-        csv_file = open(positions_csv, newline="", encoding="utf-8-sig")
-
-        reader = csv.DictReader(csv_file)
-        # Ensure all fields we want are present
-        required_elements = [
-            "Account Number",
-            "Account Name",
-            "Symbol",
-            "Description",
-            "Quantity",
-            "Last Price",
-            "Current Value",
-        ]
-        intersection_set = set(reader.fieldnames).intersection(set(required_elements))
-        if len(intersection_set) != len(required_elements):
-            raise Exception("Not enough elements in fidelity positions csv")
-
-        for row in reader:
-            # Last couple of rows have some disclaimers, filter those out
-            if row["Account Number"] is not None and "and" in str(
-                row["Account Number"]
-            ):
-                break
-            # Get the value and remove '$' from it
-            val = str(row["Current Value"]).replace("$", "")
-            # Get the last price
-            last_price = str(row["Last Price"]).replace("$", "")
-            # Get quantity
-            quantity = row["Quantity"]
-            # Get ticker
-            ticker = str(row["Symbol"])
-
-            # Don't include this if present
-            if "Pending" in ticker:
-                continue
-            # If the value isn't present, move to next row
-            if len(val) == 0:
-                continue
-            if val.lower() == "n/a":
-                val = 0
-            # If the last price isn't available, just use the current value
-            if len(last_price) == 0:
-                last_price = val
-            # If the quantity is missing, just use 1
-            if len(quantity) == 0:
-                quantity = 1
-
-            # If the account number isn't populated yet, add it
-            if row["Account Number"] not in self.account_dict:
-                # Add retrieved info.
-                # Yeah I know is kinda messy and hard to think about but it works
-                # Just need a way to store all stocks with the account number
-                # 'stocks' is a list of dictionaries. Each ticker gets its own index and is described by a dictionary
-                self.account_dict[row["Account Number"]] = {
-                    "balance": float(val),
-                    "type": row["Account Name"],
-                    "stocks": [
-                        {
-                            "ticker": ticker,
-                            "quantity": quantity,
-                            "last_price": last_price,
-                            "value": val,
-                        }
-                    ],
-                }
-            # If it is present, add to it
-            else:
-                self.account_dict[row["Account Number"]]["stocks"].append(
-                    {
-                        "ticker": ticker,
-                        "quantity": quantity,
-                        "last_price": last_price,
-                        "value": val,
-                    }
-                )
-                self.account_dict[row["Account Number"]]["balance"] += float(val)
-
-        # Close the file
-        csv_file.close()
-        os.remove(positions_csv)
-
-        return self.account_dict
-
     def open_account(self, 
         type: typing.Optional[Literal["roth", "brokerage"]] = None, 
         transfer: float = None
@@ -705,29 +946,22 @@ class FidelityAutomation:
         # works now with accoount opening and getting new account number
         if type == "roth":
             # Go to open roth page
-            self.page.goto(url="https://digital.fidelity.com/ftgw/digital/aox/RothIRAccountOpening/PersonalInformation")
-            self.wait_for_loading_sign()
+            self.page.goto(
+                url="https://digital.fidelity.com/ftgw/digital/aox/RothIRAccountOpening/PersonalInformation",
+                wait_until="domcontentloaded",
+                timeout=ACCOUNT_OPENING_TIMEOUT,
+            )
 
             # open an account
-            self.page.get_by_role("button", name="Open account").click()
+            self.page.get_by_role("button", name="Open account").click(timeout=ACCOUNT_OPENING_TIMEOUT)
             self.wait_for_loading_sign()
             congrats_message = self.page.get_by_role("heading", name="Congratulations, your account")
-            congrats_message.wait_for(state="visible")
-
-            # Navigate to the Message center
-            self.page.goto("https://servicemessages.fidelity.com/ftgw/amtd/messageCenter")
-            self.wait_for_loading_sign()
+            congrats_message.wait_for(state="visible", timeout=ACCOUNT_OPENING_TIMEOUT)
 
-            # Get the account number from the first row of the messages table
-            message_table = self.page.locator(".messages-table")
-            first_row = message_table.locator("tbody tr").first
-            account_cell = first_row.locator("td:nth-child(4)")  # 4th column is the Account column
-            account_text = account_cell.inner_text()
-
-            # Extract the account number using regex
-            match = re.search(r'ROTH IRA\s*\((\d+)\)', account_text)
-            if match:
-                self.new_account_number = match.group(1)
+            # Get the account number from the message center
+            account_number = self.find_new_account_number(ROTH_ACCOUNT_NUMBER)
+            if account_number:
+                self.new_account_number = account_number
                 print(f"New Roth IRA account number found: {self.new_account_number}")
             else:
                 print("Could not find Roth IRA account number in the message table.")
@@ -736,35 +970,31 @@ class FidelityAutomation:
         # got brokerage working
         if type == "brokerage":
             # # Go to individual brokerage page
-            self.page.goto(url="https://digital.fidelity.com/ftgw/digital/aox/BrokerageAccountOpening/JointSelectionPage")
-            self.wait_for_loading_sign()
-
-            # First section
-            self.page.get_by_role("button", name="Next").click()
-            self.wait_for_loading_sign()
+            self.page.goto(
+                url="https://digital.fidelity.com/ftgw/digital/aox/BrokerageAccountOpening/JointSelectionPage",
+                wait_until="domcontentloaded",
+                timeout=ACCOUNT_OPENING_TIMEOUT,
+            )
 
             # If application is already started, then there will only be 1 "Next" button
-            self.page.get_by_role("button", name="Next").click()
-            self.wait_for_loading_sign()
+            next_button = self.page.get_by_role("button", name="Next")
+            open_button = self.page.get_by_role("button", name="Open account")
+            for _ in range(2):
+                # Wait for whichever button the page shows next
+                next_button.or_(open_button).first.wait_for(state="visible", timeout=ACCOUNT_OPENING_TIMEOUT)
+                if open_button.is_visible():
+                    break
+                next_button.click()
+                self.wait_for_loading_sign()
             
             # Open account
-            self.page.get_by_role("button", name="Open account").click()
+            open_button.click(timeout=ACCOUNT_OPENING_TIMEOUT)
             self.wait_for_loading_sign()
 
-            # Navigate to the Message center
-            self.page.goto("https://servicemessages.fidelity.com/ftgw/amtd/messageCenter")
-            self.wait_for_loading_sign()
-
-            # Get the account number from the first row of the messages table
-            message_table = self.page.locator(".messages-table")
-            first_row = message_table.locator("tbody tr").first
-            account_cell = first_row.locator("td:nth-child(4)")  # 4th column is the Account column
-            account_text = account_cell.inner_text()
-            
-            # Extract the account number from the text (it's in parentheses)
-            match = re.search(r'\((Z\d+)\)', account_text)
-            if match:
-                self.new_account_number = match.group(1)
+            # Get the account number from the message center. It's in parentheses
+            account_number = self.find_new_account_number(BROKERAGE_ACCOUNT_NUMBER)
+            if account_number:
+                self.new_account_number = account_number
                 print(f"New account created: {self.new_account_number}")
             else:
                 print("Could not find account number in the message table.")
@@ -784,7 +1014,41 @@ class FidelityAutomation:
         
         return (False, None)
 
-            
+
+    def find_new_account_number(self, pattern: re.Pattern):
+        """
+        Finds the number of a newly opened account from the message center.
+        The message list is read from the json the page loads if it names exactly one matching account.
+        Otherwise the first row of the messages table is used.
+
+        Parameters:
+            pattern: re.Pattern: Compiled regex with one group that captures the account number
+
+        Returns:
+            account_number: str: The account number or None if it wasn't found
+        """
+        account_numbers = set()
+        # Navigate to the Message center and catch the messages as they are loaded
+        try:
+            with self.page.expect_response(
+                lambda response: "servicemessages" in response.url and "json" in response.headers.get("content-type", ""),
+                timeout=10000,
+            ) as response_info:
+                self.page.goto("https://servicemessages.fidelity.com/ftgw/amtd/messageCenter", wait_until="domcontentloaded")
+            account_numbers = set(pattern.findall(response_info.value.text()))
+        except PlaywrightTimeoutError:
+            pass
+        # Only trust the json if there is no question which account is the new one
+        if len(account_numbers) == 1:
+            return account_numbers.pop()
+
+        # Get the account number from the first row of the messages table
+        message_table = self.page.locator(".messages-table")
+        first_row = message_table.locator("tbody tr").first
+        account_cell = first_row.locator("td:nth-child(4)")  # 4th column is the Account column
+        match = pattern.search(account_cell.inner_text())
+        return match.group(1) if match else None
+
     def fund_account(self, source_account: str, new_account_number: str, transfer_amount: float) -> bool:
         """
         Funds the newly created account by transferring money from a source account.
@@ -797,35 +1061,52 @@ class FidelityAutomation:
         Returns:
         bool: True if the transfer was successful, False otherwise.
         """
+        # The positions total is never less than the cash available to transfer.
+        # If the amount is over the total there's no need to load the transfer page
+        cached_balance = self.account_dict.get(source_account, {}).get("balance")
+        if cached_balance is not None and transfer_amount > cached_balance:
+            print(f"Insufficient funds. Account value: ${cached_balance}, Attempted transfer: ${transfer_amount}")
+            return False
+
         try:
             # Navigate to the transfer page
-            self.page.goto(url="https://digital.fidelity.com/ftgw/digital/transfer/?quicktransfer=cash-shares")
-            self.wait_for_loading_sign()
+            self.page.goto(
+                url="https://digital.fidelity.com/ftgw/digital/transfer/?quicktransfer=cash-shares",
+                wait_until="domcontentloaded",
+            )
 
             # Select the source account from the 'From' dropdown
             from_select = self.page.get_by_label("From")
-            options = from_select.locator("option").all()
-            source_value = None
-            for option in options:
-                if source_account in option.inner_text():
-                    source_value = option.get_attribute("value")
-                    break
+            from_select.wait_for(state="visible", timeout=10000)
+            # The source accounts don't change during a session so reuse the map if we have one
+            source_value = self.find_dropdown_value(self.from_account_map, source_account)
+            from_cache = source_value is not None
+            if not from_cache:
+                self.from_account_map = self.get_dropdown_map(from_select)
+                source_value = self.find_dropdown_value(self.from_account_map, source_account)
             
             if source_value is None:
                 print(f"Source account {source_account} not found in dropdown")
                 return False
             
-            from_select.select_option(source_value)
+            try:
+                from_select.select_option(source_value)
+            except PlaywrightError:
+                # A value from the cached map may be out of date. Read the dropdown again and retry once
+                if not from_cache:
+                    raise
+                self.from_account_map = self.get_dropdown_map(from_select)
+                source_value = self.find_dropdown_value(self.from_account_map, source_account)
+                if source_value is None:
+                    print(f"Source account {source_account} not found in dropdown")
+                    return False
+                from_select.select_option(source_value)
             self.wait_for_loading_sign()
 
             # Select the new account from the 'To' dropdown
             to_select = self.page.get_by_label("To", exact=True)
-            options = to_select.locator("option").all()
-            new_account_value = None
-            for option in options:
-                if new_account_number in option.inner_text():
-                    new_account_value = option.get_attribute("value")
-                    break
+            # Always rebuild this one since the new account was just added
+            new_account_value = self.find_dropdown_value(self.get_dropdown_map(to_select), new_account_number)
             
             if new_account_value is None:
                 print(f"New account {new_account_number} not found in 'To' dropdown")
@@ -834,9 +1115,10 @@ class FidelityAutomation:
             to_select.select_option(new_account_value)
             self.wait_for_loading_sign()
 
-            # Get the available balance
-            available_balance = self.page.locator("tr.pvd-table__row:nth-child(2) > td:nth-child(2)").inner_text()
-            available_balance = float(available_balance.replace("$", "").replace(",", ""))
+            # Get the available balance. float raises on an empty or unreadable cell so the transfer stops
+            available_balance = float(
+                self.page.locator("tr.pvd-table__row:nth-child(2) > td:nth-child(2)").inner_text().translate(MONEY_SYMBOLS)
+            )
 
             # Check if there's enough balance
             if transfer_amount > available_balance:
@@ -864,63 +1146,114 @@ class FidelityAutomation:
         except Exception as e:
             print(f"An error occurred during the transfer: {str(e)}")
             return False
-       
-        
 
-    def enable_pennystock_trading(self, account: str) -> bool:
+
+    def get_dropdown_map(self, select) -> dict:
+        """
+        Reads every option of a select element in a single evaluate and maps the full
+        text of each option to the option's value.
+
+        Parameters:
+            select: Locator: The locator of the select element to read
+
+        Returns:
+            account_map: dict: Option text as keys and option values as values
+        """
+        pairs = select.evaluate("sel => Array.from(sel.options).map(o => [o.text, o.value])")
+        return {text.strip(): value for text, value in pairs}
+
+    @staticmethod
+    def find_dropdown_value(account_map: dict, account: str):
+        """
+        Finds the option value for an account in a map from get_dropdown_map.
+        Tries an option whose account number is exactly the account first. Ex: Individual (Z12345678)
+        Then any option whose text contains it (Ex: the last 4 digits or a nickname)
+
+        Returns:
+            value: str: The option value or None if the account isn't in the map
+        """
+        value = next((v for t, v in account_map.items() if account in DROPDOWN_ACCOUNT_NUMBER.findall(t)), None)
+        if value is None:
+            value = next((v for t, v in account_map.items() if account in t), None)
+        return value
+
+    def enable_pennystock_trading(self, account: str, max_retries: int = 3) -> bool:
         """
         Enables penny stock trading for the account given.
         The account is just the account number, no nickname
+
+        Parameters:
+            account: str: The account number to enable penny stock trading on
+            max_retries: int: How many times to retry if the page hangs on a loading sign
+
+        Returns:
+            True: bool: If penny stock trading was enabled
+            False: bool: If every attempt timed out
         
         TODO make account parameter into a list so i can just iterate through all available accounts 
         (this might not work becuase new accounts dont have positions and dont show up in the account info function)
         
         """
-        # Maybe need to go through the normal way of getting to this page and not via url
-        self.page.goto(url="https://digital.fidelity.com/ftgw/digital/portfolio/features")
-        self.page.get_by_label("Manage Penny Stock Trading").click()
+        for attempt in range(max_retries):
+            # Back off a little more each time we retry
+            if attempt > 0:
+                print(f"Retrying penny stock enable ({attempt}/{max_retries - 1})...")
+                sleep(2 ** attempt)
 
-        self.page.wait_for_load_state(state="load", timeout=30000)
-        self.wait_for_loading_sign()
-        if self.page.get_by_role("button", name="Start").is_visible():
-            self.page.get_by_role("button", name="Start").click()
-        self.wait_for_loading_sign()
+            # Maybe need to go through the normal way of getting to this page and not via url
+            self.goto_if_needed("https://digital.fidelity.com/ftgw/digital/portfolio/features")
+            self.page.get_by_label("Manage Penny Stock Trading").click()
 
-        # Ensure the page is loaded
-        select_account_title = self.page.get_by_role("heading", name="Select an account")
-        select_account_title.wait_for(timeout=30000, state="visible")
+            self.page.wait_for_load_state(state="domcontentloaded", timeout=30000)
+            self.wait_for_loading_sign()
+            start_button = self.page.get_by_role("button", name="Start")
+            if self.is_visible_within(start_button):
+                start_button.click()
+            self.wait_for_loading_sign()
 
-        # There are 2 versions of this. A checkbox and a drop down
+            # Ensure the page is loaded
+            select_account_title = self.page.get_by_role("heading", name="Select an account")
+            select_account_title.wait_for(timeout=30000, state="visible")
 
-        # Checkbox version
-        # This one seems to have trouble with infinite loading sign
-        if self.page.locator("label").filter(has_text=account).is_visible():
-            # This seems to never work for checkbox version so reload and try for dropdown version
-            # return self.enable_pennystock_trading(account=account)
-            self.page.locator("label").filter(has_text=account).click()
+            # There are 2 versions of this. A checkbox and a drop down.
+            # Wait for whichever one shows up instead of probing each one
+            account_checkbox = self.page.locator("label").filter(has_text=account)
+            account_dropdown = self.page.get_by_label("Your eligible accounts")
+            self.is_visible_within(account_checkbox.or_(account_dropdown).first, timeout=10000)
 
-        # Dropdown version
-        if self.page.get_by_label("Your eligible accounts").is_visible():
-            self.page.get_by_label("Your eligible accounts").select_option(account)
-        
-        # Continue with enabling
-        self.page.get_by_role("button", name="Continue").click()
-        try:
-            self.wait_for_loading_sign(timeout=60000)
-        except PlaywrightTimeoutError:
-            # Reload
-            return self.enable_pennystock_trading(account=account)
+            # Checkbox version
+            # This one seems to have trouble with infinite loading sign
+            if account_checkbox.is_visible():
+                account_checkbox.click()
 
-        self.page.wait_for_url(url="https://digital.fidelity.com/ftgw/digital/easy/hrt/pst/termsandconditions")
-        self.wait_for_loading_sign()
-        # Accept the risks
-        self.page.query_selector(".pvd-checkbox__label").click()
-        self.page.get_by_role("button", name="Submit").click()
-        self.wait_for_loading_sign()
-        # Verify success
-        success_ribbon = self.page.get_by_role("heading", name="Success!")
-        success_ribbon.wait_for(state="visible", timeout=30000)
-        return True
+            # Dropdown version
+            if account_dropdown.is_visible():
+                account_dropdown.select_option(account)
+            
+            # Continue with enabling
+            self.page.get_by_role("button", name="Continue").click()
+            try:
+                self.wait_for_loading_sign(timeout=60000)
+            except PlaywrightTimeoutError:
+                # Go back to the features page and try again
+                self.page.goto(url="https://digital.fidelity.com/ftgw/digital/portfolio/features", wait_until="domcontentloaded")
+                continue
+
+            # Only wait for the terms page if we aren't already on it
+            if "termsandconditions" not in self.page.url.lower():
+                self.page.wait_for_url(url="https://digital.fidelity.com/ftgw/digital/easy/hrt/pst/termsandconditions", wait_until="commit")
+            self.wait_for_loading_sign()
+            # Accept the risks
+            self.page.locator(".pvd-checkbox__label").first.click()
+            self.page.get_by_role("button", name="Submit").click()
+            self.wait_for_loading_sign()
+            # Verify success
+            success_ribbon = self.page.get_by_role("heading", name="Success!")
+            success_ribbon.wait_for(state="visible", timeout=30000)
+            return True
+
+        print(f"Could not enable penny stock trading for {account} after {max_retries} attempts")
+        return False
     
     def download_prev_statement(self, date: str):
         """
@@ -930,139 +1263,326 @@ class FidelityAutomation:
 
         Parameters:
             date: str: The month and year for the statement to download. Format of MM/YYYY
+
+        Returns:
+            statement: str: The absolute file path of the downloaded statement
         """
+        download = self._start_statement_download(date)
+        return self._save_download(download)
 
-        # Trim date down
-        month = date[:2]
-        year = date[-4:]
+    def download_statements(self, dates: list) -> list:
+        """
+        Downloads the multi-account statements for each of the months given.
+        Every download is started before any of them are saved so the transfers
+        run in the background while the next statement is being requested.
 
-        # Convert to month
-        month = fid_months(int(month)).name
-        
-        # Build statement name string
-        beginning = str(month) + " " + year
-        # Convert to 3 letter month followed by year
-        self.page.goto(url="https://digital.fidelity.com/ftgw/digital/portfolio/documents/dochub")
+        Parameters:
+            dates: list: The months and years for the statements to download. Format of MM/YYYY
+
+        Returns:
+            statements: list: The absolute file paths of the downloaded statements in the same order as dates
+        """
+        downloads = [self._start_statement_download(date) for date in dates]
+        return [self._save_download(download) for download in downloads]
+
+    def _start_statement_download(self, date: str):
+        """
+        Starts the download of the statement for the given month and returns the
+        playwright download object without waiting for it to finish.
+        """
+        # Build statement name string from the 3 letter month followed by year
+        month = int(date[:2])
+        # A negative index would quietly wrap around to another month
+        if not 1 <= month <= 12:
+            raise ValueError(f"Invalid month in statement date: {date}")
+        beginning = f"{FID_MONTH_NAMES[month - 1]} {date[-4:]}"
+        self.goto_if_needed("https://digital.fidelity.com/ftgw/digital/portfolio/documents/dochub")
         self.page.get_by_role("row", name=f"{beginning} — Statement (pdf)").get_by_label("download statement").click()
         with self.page.expect_download() as download_info:
             with self.page.expect_popup() as page1_info:
                 self.page.get_by_role("menuitem", name="Download as PDF").click()
             page1 = page1_info.value
         download = download_info.value
+        page1.close()
+        return download
+
+    def _save_download(self, download):
+        """
+        Waits for the given download to finish and saves it to the current directory
+        using the file name suggested by fidelity.
+        """
         cur = os.getcwd()
         statement = os.path.join(cur, download.suggested_filename)
         # Create a copy to work on with the proper file name known
         download.save_as(statement)
-        page1.close()
         return statement
 
+    def is_visible_within(self, locator, timeout: int = 500) -> bool:
+        """
+        Waits a short time for the locator to become visible instead of checking only once.
+
+        Parameters:
+            locator: Locator: The element to wait for
+            timeout: int: How long to wait in milliseconds
+
+        Returns:
+            True: bool: If the element became visible in time
+            False: bool: If it did not
+        """
+        try:
+            locator.wait_for(state="visible", timeout=timeout)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    def goto_if_needed(self, url: str, wait_until: str = "domcontentloaded"):
+        """
+        Navigates to the url unless the page is already on it.
+        Only waits for the document by default since callers wait on the elements they use.
+
+        Parameters:
+            url: str: The page to go to. Any url starting with this counts as already being there
+            wait_until: str: The load state the navigation waits for
+        """
+        if not self.page.url.startswith(url):
+            self.page.goto(url, wait_until=wait_until)
+
     def wait_for_loading_sign(self, timeout: int = 30000):
-        # Wait for all kinds of loading signs
-        signs = [self.page.locator("div:nth-child(2) > .loading-spinner-mask-after").first,
-                 self.page.locator(".pvd-spinner__mask-inner").first,
-                 self.page.locator("pvd-loading-spinner").first,
-                ]
-        for sign in signs:
-            sign.wait_for(timeout=timeout, state="hidden") 
+        # Wait for all kinds of loading signs at once. Matches only visible spinners, so once nothing
+        # matches every sign is gone and the whole wait is bounded by a single timeout
+        self.page.locator(LOADING_SIGNS).first.wait_for(timeout=timeout, state="detached")
 
     def transfer_acc_to_acc(self, source_account: str, destination_account: str):
         """
         WORK IN PROGRESS. NOT FULLY IMPLEMENTED
         """
         # Go to the transfer between accounts page
-        self.page.goto(url="https://digital.fidelity.com/ftgw/digital/transfer/?quicktransfer=cash-shares")
-        self.page.wait_for_load_state("load")
-        self.wait_for_loading_sign()
+        self.page.goto(
+            url="https://digital.fidelity.com/ftgw/digital/transfer/?quicktransfer=cash-shares",
+            wait_until="domcontentloaded",
+        )
         
-        # Select the source account
-        self.page.get_by_label("From").select_option(source_account)
+        # Select the source account once the dropdown is usable
+        from_select = self.page.get_by_label("From")
+        from_select.wait_for(state="visible", timeout=10000)
+        from_select.select_option(source_account)
         self.wait_for_loading_sign()
 
         # Ensure account has the money to transfer
-        available = self.page.query_selector("tr.pvd-table__row:nth-child(2) > td:nth-child(2)").text_content()
-        available = float(available.replace("$", ""))
+        available = float(
+            self.page.locator("tr.pvd-table__row:nth-child(2) > td:nth-child(2)").inner_text().translate(MONEY_SYMBOLS)
+        )
         pass
 
 # --------------------------------------- TEST AREA --------------------------------------- #
-# Create fidelity driver class
-browser = FidelityAutomation(headless=False, save_state=False)
-try:
-    # Delete old variable in envrionment
-    if os.getenv("FIDELITY"):
-        os.environ.pop("FIDELITY")
-    # Initialize .env file
-    load_dotenv()
-    # Import Fidelity account
-    if not os.getenv("FIDELITY"):
-        raise Exception("Fidelity not found, skipping...")
-
-    accounts = (os.environ["FIDELITY"].strip().split(","))
-    for account in accounts:
-        account = account.split(':')
-        step_1, step_2 = browser.login(
+def run_script(browser: FidelityAutomation, steps: list, username: str):
+    """
+    Replays the scripted actions for the logged in user back to back without prompting.
+
+    Parameters:
+        browser: FidelityAutomation: The logged in driver to run the actions with
+        steps: list: Dictionaries with 'action', 'params' and optionally 'account'.
+        Ex: {"account": "user1", "action": "open_account", "params": {"type": "roth", "transfer": 5}}
+        Steps without an 'account' run for every login.
+        username: str: The username of the current login
+    """
+    actions = {
+        "getAccountInfo": browser.getAccountInfo,
+        "open_account": browser.open_account,
+        "fund_account": browser.fund_account,
+        "enable_pennystock_trading": browser.enable_pennystock_trading,
+        "transaction": browser.transaction,
+        "download_prev_statement": browser.download_prev_statement,
+        "download_statements": browser.download_statements,
+    }
+    for step in steps:
+        if step.get("account", username) != username:
+            continue
+        if step["action"] not in actions:
+            print(f"Unknown action in script: {step['action']}")
+            continue
+        print(f"{step['action']}: {actions[step['action']](**step.get('params', {}))}")
+
+
+def run_account_script(account: str, steps: list, use_profile: bool = False):
+    """
+    Logs into one account in its own browser context and replays the script for it.
+    This is run by the worker threads of run_accounts_script so accounts run at the same time.
+
+    Parameters:
+        account: str: The login info. Format of username:password:totp_secret:source_account
+        steps: list: The scripted actions. See run_script
+        use_profile: bool: Keep a firefox profile folder for the account between runs.
+        The profile launches a browser of its own so the shared browser and FIDELITY_WS_ENDPOINT aren't used
+    """
+    account = account.split(':')
+    user_data_dir = None
+    if use_profile:
+        # The profile folder is tied to the username so a logged in profile can only ever be reused by the same account
+        user_data_dir = f"./profile-{UNSAFE_PATH_CHARS.sub('_', account[0])}"
+    # Made in this thread so it gets a context on this thread's browser
+    browser = FidelityAutomation(headless=False, save_state=False, user_data_dir=user_data_dir)
+    try:
+        browser.login(
             username=account[0],
             password=account[1],
             totp_secret=account[2] if len(account) > 2 else None,
             source_account=account[3],
             save_device=False,
         )
-        print("Logged in")
+        print(f"Logged in to {account[0]}")
+        run_script(browser, steps, account[0])
+    finally:
+        # Only the context is closed. The thread's browser is kept for its next account
+        browser.close_browser()
 
-        # User input for account type and transfer amount
-        account_type = input("Enter account type to open (roth/brokerage): ").lower()
-        while account_type not in ["roth", "brokerage"]:
-            account_type = input("Invalid input. Please enter 'roth' or 'brokerage': ").lower()
-        
-        transfer_amount = float(input("Enter the amount to transfer to the new account: "))
-        
-        success, account_num = browser.open_account(account_type, transfer_amount)
-        
-        if success:
-            print(f"Successfully opened {account_type} account")
-        if account_num:
-            print(f"New account number: {account_num}")
-        
-        enable_penny_stocks = input("Do you want to enable penny stock trading for this account? (y/n): ").lower()
-        if enable_penny_stocks == 'y':
-            browser.enable_pennystock_trading(account_num)
-            print("Penny stock trading enabled")
-except Exception as e:
-    print(e)
-
-exit_con = 1
-while exit_con:
-
-    browser.page.pause()
-    choice = input("""
-                   0: Quit\n
-                   1: locator string\n
-                   2: CSS selector string\n
-                   3: Get by text\n
-                   4: Get by role\n
-                   5: Get by label\n
-                   6: Goto url\n
-                   7: Get text of CSS selector\n
-                   """)
-    choice = int(choice)
+
+def run_accounts_script(accounts: list, steps: list, max_workers: int = MAX_PARALLEL_ACCOUNTS, use_profile: bool = False):
+    """
+    Replays the script for every account at the same time.
+    Each worker thread launches one browser and runs its accounts as separate contexts on it.
+    Playwright can't share a browser between threads, so set FIDELITY_WS_ENDPOINT to run every
+    account on a single browser server instead
+
+    Parameters:
+        accounts: list: The login info for each account. See run_account_script
+        steps: list: The scripted actions. See run_script
+        max_workers: int: The most browsers that will be open at once
+        use_profile: bool: Keep a firefox profile folder for each account between runs. See run_account_script
+    """
+    pending = queue.Queue()
+    for account in accounts:
+        pending.put(account)
+
+    def worker():
+        try:
+            # Keep taking accounts until none are left so the browser is reused between them
+            while True:
+                try:
+                    account = pending.get_nowait()
+                except queue.Empty:
+                    return
+                run_account_script(account, steps, use_profile)
+        finally:
+            # Close this thread's browser once it has no accounts left
+            FidelityAutomation.shutdown()
+
+    worker_count = min(len(accounts), max_workers)
+    with ThreadPoolExecutor(max_workers=worker_count) as pool:
+        futures = [pool.submit(worker) for _ in range(worker_count)]
+        for future in futures:
+            future.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fidelity automation test driver")
+    parser.add_argument("--script", help="JSON file of actions to replay instead of prompting")
+    parser.add_argument(
+        "--profiles",
+        action="store_true",
+        help="Keep a firefox profile per account between --script runs. Each profile launches its own browser and ignores FIDELITY_WS_ENDPOINT",
+    )
+    args = parser.parse_args()
+    script_steps = None
+    if args.script:
+        with open(args.script, "r") as f:
+            script_steps = json.load(f)
+
+    # Delete old variable in envrionment
+    if os.getenv("FIDELITY"):
+        os.environ.pop("FIDELITY")
+    # Initialize .env file
+    load_dotenv()
+
+    # Scripts don't wait on any input so every account can run at once, each in its own context
+    if script_steps is not None:
+        try:
+            # Import Fidelity account
+            if not os.getenv("FIDELITY"):
+                raise Exception("Fidelity not found, skipping...")
+            accounts = (os.environ["FIDELITY"].strip().split(","))
+            run_accounts_script(accounts, script_steps, use_profile=args.profiles)
+        except Exception as e:
+            print(e)
+        exit()
+
+    # Create fidelity driver class
+    browser = FidelityAutomation(headless=False, save_state=False)
     try:
-        if choice > 0:
-            str_in = input("Enter the str to click")
-            if choice == 1:
-                browser.page.locator(str_in).click()
-            if choice == 2:
-                browser.page.query_selector(str_in).click()
-            if choice == 3:
-                browser.page.get_by_text(str_in).click()
-            if choice == 4:
-                browser.page.get_by_role(str_in).click()
-            if choice == 5:
-                browser.page.get_by_label(str_in).click()
-            if choice == 6:
-                browser.page.goto(str_in)
-            if choice == 7:
-                print(browser.page.query_selector(str_in).text_content())
-        else:
-            exit_con = 0
-    except:
-        pass
-        
+        # Import Fidelity account
+        if not os.getenv("FIDELITY"):
+            raise Exception("Fidelity not found, skipping...")
+
+        accounts = (os.environ["FIDELITY"].strip().split(","))
+        for account in accounts:
+            account = account.split(':')
+            step_1, step_2 = browser.login(
+                username=account[0],
+                password=account[1],
+                totp_secret=account[2] if len(account) > 2 else None,
+                source_account=account[3],
+                save_device=False,
+            )
+            print("Logged in")
+
+            # User input for account type and transfer amount
+            account_type = input("Enter account type to open (roth/brokerage): ").lower()
+            while account_type not in ["roth", "brokerage"]:
+                account_type = input("Invalid input. Please enter 'roth' or 'brokerage': ").lower()
+
+            transfer_amount = float(input("Enter the amount to transfer to the new account: "))
+
+            success, account_num = browser.open_account(account_type, transfer_amount)
+
+            if success:
+                print(f"Successfully opened {account_type} account")
+            if account_num:
+                print(f"New account number: {account_num}")
+
+            enable_penny_stocks = input("Do you want to enable penny stock trading for this account? (y/n): ").lower()
+            if enable_penny_stocks == 'y':
+                if browser.enable_pennystock_trading(account_num):
+                    print("Penny stock trading enabled")
+                else:
+                    print("Penny stock trading was not enabled")
+    except Exception as e:
+        print(e)
+
+    MENU = """
+                       0: Quit\n
+                       1: locator string\n
+                       2: CSS selector string\n
+                       3: Get by text\n
+                       4: Get by role\n
+                       5: Get by label\n
+                       6: Goto url\n
+                       7: Get text of CSS selector\n
+                       """
+    # Each menu choice takes the string entered by the user
+    menu_actions = {
+        1: lambda str_in: browser.page.locator(str_in).click(),
+        2: lambda str_in: browser.page.locator(str_in).first.click(),
+        3: lambda str_in: browser.page.get_by_text(str_in).click(),
+        4: lambda str_in: browser.page.get_by_role(str_in).click(),
+        5: lambda str_in: browser.page.get_by_label(str_in).click(),
+        6: lambda str_in: browser.page.goto(str_in),
+        7: lambda str_in: print(browser.page.locator(str_in).first.inner_text()),
+    }
+    exit_con = 1
+    while exit_con:
+
+        browser.page.pause()
+        try:
+            choice = int(input(MENU))
+            if choice > 0:
+                str_in = input("Enter the str to click")
+                if choice in menu_actions:
+                    menu_actions[choice](str_in)
+            else:
+                exit_con = 0
+        # Only swallow bad input and failed page actions so Ctrl-C still exits
+        except (PlaywrightError, ValueError) as e:
+            print(e)
+
+    browser.close_browser()
+    FidelityAutomation.shutdown()
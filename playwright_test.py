@@ -10,50 +10,68 @@ from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeo
 from playwright_stealth import StealthConfig, stealth_sync  
 
 
-# Get login info
-try:
-    load_dotenv()
-    username = os.getenv('FIDELITY_USERNAME')
-    password = os.getenv('FIDELTIY_PASSWORD')
-except:
-    print('Could not get username and password')
-    exit()
-
-playwright = sync_playwright().start()
-browser = playwright.chromium.launch(headless=False)
-context = browser.new_context()
-cookies_loaded = False
-try:
-    f = open('fidelity_cookies.json')
-    cookies = json.load(f)
-    context.add_cookies(cookies)
-    cookies_loaded = True
-    print("Cookies loaded")
-except FileNotFoundError:
-    print("File not found")
-except json.JSONDecodeError:
-    print("Error decoding")
-    
-page = context.new_page()
-stealth_config = StealthConfig(
-            navigator_languages=False,
-            navigator_user_agent=False,
-            navigator_vendor=False,
-        )
-stealth_sync(page, stealth_config)
-
-page.goto("https://digital.fidelity.com/prgw/digital/login/full-page")
-
-# Login page
-page.get_by_label("Username", exact=True).click()
-page.get_by_label("Username", exact=True).fill(username)
-page.get_by_label("Password", exact=True).click()
-page.get_by_label("Password", exact=True).fill(password)
-page.get_by_role("button", name="Log in").click()
-
-page.locator("label").filter(has_text="Don't ask me again on this").check()
-
-page.pause()
+# Browser objects made by get_page. Nothing is started until a page is asked for
+_state = {}
+
+
+def get_page():
+    """
+    Starts playwright, loads saved cookies, and applies stealth to a new page on the first call.
+    Later calls return the same page.
+    """
+    if "page" in _state:
+        return _state["page"]
+
+    playwright = sync_playwright().start()
+    browser = playwright.chromium.launch(headless=False)
+    context = browser.new_context()
+    try:
+        f = open('fidelity_cookies.json')
+        cookies = json.load(f)
+        context.add_cookies(cookies)
+        _state["cookies_loaded"] = True
+        print("Cookies loaded")
+    except FileNotFoundError:
+        print("File not found")
+    except json.JSONDecodeError:
+        print("Error decoding")
+
+    page = context.new_page()
+    stealth_config = StealthConfig(
+                navigator_languages=False,
+                navigator_user_agent=False,
+                navigator_vendor=False,
+            )
+    stealth_sync(page, stealth_config)
+
+    _state.update(playwright=playwright, browser=browser, context=context, page=page)
+    return page
+
+
+if __name__ == "__main__":
+    # Get login info
+    try:
+        load_dotenv()
+        username = os.getenv('FIDELITY_USERNAME')
+        password = os.getenv('FIDELTIY_PASSWORD')
+    except:
+        print('Could not get username and password')
+        exit()
+
+    page = get_page()
+
+    page.goto("https://digital.fidelity.com/prgw/digital/login/full-page")
+
+    # Login page
+    page.get_by_label("Username", exact=True).click()
+    page.get_by_label("Username", exact=True).fill(username)
+    page.get_by_label("Password", exact=True).click()
+    page.get_by_label("Password", exact=True).fill(password)
+    page.get_by_role("button", name="Log in").click()
+
+    page.locator("label").filter(has_text="Don't ask me again on this").check()
+
+    page.pause()
 
 
 